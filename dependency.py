@@ -1,6 +1,26 @@
+from collections import deque
+
+import numpy as np
 import pandas as pd
 import networkx as nx
 
+try:
+    import nx_cugraph  # noqa: F401  (registers the "cugraph" NetworkX backend)
+    HAS_CUGRAPH = True
+except ImportError:
+    HAS_CUGRAPH = False
+
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+# Graphs above this size are dispatched to the GPU backend when available
+CUGRAPH_MIN_NODES = 50_000
+# Below this size the JIT compile cost outweighs the faster level computation
+NUMBA_MIN_NODES = 5_000
+
 # Load input CSV
 df = pd.read_csv("dependency_data.csv")  # replace with your filename
 
@@ -10,40 +30,113 @@ df["TargetFull"] = df["Target DB Name"] + "." + df["Target Schema Name"] + "." +
 
 # Build the directed graph
 G = nx.DiGraph()
-for _, row in df.iterrows():
-    G.add_edge(row["SourceFull"], row["TargetFull"])
+G.add_edges_from(zip(df["SourceFull"].to_numpy(), df["TargetFull"].to_numpy()))
 
 # Optional: Detect cycles before proceeding
-try:
-    cycles = list(nx.find_cycle(G, orientation='original'))
-    if cycles:
-        print("❌ Cycle detected:")
-        print(" -> ".join(str(edge[0]) for edge in cycles + [cycles[0]]))
-        raise Exception("Graph contains a cycle. Cannot proceed with topological sort.")
-except nx.NetworkXNoCycle:
+if nx.is_directed_acyclic_graph(G):
     print("✅ No cycles detected.")
+else:
+    cycles = list(nx.find_cycle(G, orientation='original'))
+    print("❌ Cycle detected:")
+    print(" -> ".join(str(edge[0]) for edge in cycles + [cycles[0]]))
+    raise Exception("Graph contains a cycle. Cannot proceed with topological sort.")
+
+# Kahn's algorithm over CSR adjacency; returns 0-based levels
+def kahn_levels_csr(indptr, indices, indeg):
+    n = indeg.shape[0]
+    level = np.zeros(n, dtype=np.int64)
+    queue = np.empty(n, dtype=np.int32)
+    tail = 0
+    for i in range(n):
+        if indeg[i] == 0:
+            queue[tail] = i
+            tail += 1
 
-# Compute levels via topological sort
+    head = 0
+    while head < tail:
+        u = queue[head]
+        head += 1
+        for k in range(indptr[u], indptr[u + 1]):
+            v = indices[k]
+            if level[u] + 1 > level[v]:
+                level[v] = level[u] + 1
+            indeg[v] -= 1
+            if indeg[v] == 0:
+                queue[tail] = v
+                tail += 1
+    return level
+
+if HAS_NUMBA:
+    kahn_levels_csr = njit(cache=True)(kahn_levels_csr)
+
+def to_csr(graph, idx):
+    # DiGraph.edges yields edges grouped by source in node order, so the
+    # targets are already laid out row by row
+    m = graph.number_of_edges()
+    src = np.fromiter((idx[u] for u, _ in graph.edges), dtype=np.int32, count=m)
+    indices = np.fromiter((idx[v] for _, v in graph.edges), dtype=np.int32, count=m)
+    indptr = np.zeros(len(idx) + 1, dtype=np.int32)
+    np.cumsum(np.bincount(src, minlength=len(idx)), out=indptr[1:])
+    indeg = np.bincount(indices, minlength=len(idx)).astype(np.int32)
+    return indptr, indices, indeg
+
+# Compute levels with Kahn's algorithm over integer-indexed adjacency
 def calculate_node_levels(graph):
-    levels = {}
-    for node in nx.topological_sort(graph):
-        preds = list(graph.predecessors(node))
-        levels[node] = max([levels[p] for p in preds], default=0) + 1
-    return levels
+    nodes = list(graph.nodes)
+    idx = {n: i for i, n in enumerate(nodes)}
+    if HAS_NUMBA and len(nodes) > NUMBA_MIN_NODES:
+        level = kahn_levels_csr(*to_csr(graph, idx))
+        return {nodes[i]: int(level[i]) + 1 for i in range(len(nodes))}
+
+    # Plain lists: scalar numpy indexing is slower inside a Python loop
+    succ = [[idx[v] for v in graph.successors(n)] for n in nodes]
+    indeg = [graph.in_degree(n) for n in nodes]
+    level = [0] * len(nodes)
+
+    queue = deque(i for i, d in enumerate(indeg) if d == 0)
+    while queue:
+        u = queue.popleft()
+        lu = level[u] + 1
+        for v in succ[u]:
+            if lu > level[v]:
+                level[v] = lu
+            indeg[v] -= 1
+            if indeg[v] == 0:
+                queue.append(v)
+    return {nodes[i]: level[i] + 1 for i in range(len(nodes))}
 
 levels = calculate_node_levels(G)
 
-# Assign Node (level transition) and UltimateRoot
-def format_node_level(src, tgt):
-    return f"{levels.get(src, 1)} to {levels.get(tgt, 2)}"
+def topological_order(graph):
+    if HAS_CUGRAPH and len(graph) > CUGRAPH_MIN_NODES:
+        try:
+            return list(nx.topological_sort(graph, backend="cugraph"))
+        except (NotImplementedError, nx.NetworkXNotImplemented):
+            pass  # fall back to the CPU implementation
+    return list(nx.topological_sort(graph))
+
+# Assign UltimateRoot by propagating root sets down the DAG once
+def calculate_root_sets(graph):
+    roots_of = {}
+    for node in topological_order(graph):
+        preds = list(graph.predecessors(node))
+        if preds:
+            roots_of[node] = frozenset().union(*(roots_of[p] for p in preds))
+        else:
+            roots_of[node] = frozenset([node])
+    return roots_of
+
+roots_of = calculate_root_sets(G)
 
 def find_roots(node):
-    root_nodes = [n for n in G.nodes if G.in_degree(n) == 0]
-    return ",".join(sorted(r for r in root_nodes if nx.has_path(G, r, node)))
+    return ",".join(sorted(roots_of.get(node, ())))
 
 # Add results to DataFrame
-df["Node"] = df.apply(lambda row: format_node_level(row["SourceFull"], row["TargetFull"]), axis=1)
-df["UltimateRoot"] = df["TargetFull"].apply(find_roots)
+src_level = df["SourceFull"].map(levels).fillna(1).astype(int).astype(str)
+tgt_level = df["TargetFull"].map(levels).fillna(2).astype(int).astype(str)
+df["Node"] = src_level + " to " + tgt_level
+root_cache = {t: find_roots(t) for t in df["TargetFull"].unique()}
+df["UltimateRoot"] = df["TargetFull"].map(root_cache)
 
 # Optional: Save updated output
 df.to_csv("dependency_data_with_nodes_and_roots.csv", index=False)
@@ -1,8 +1,10 @@
 import sqlglot
-from sqlglot.expressions import Select, Column, Alias, Table, Create, Union, Subquery
+from sqlglot.expressions import Select, Column, Alias, Table, Create, SetOperation, Subquery
+from sqlglot.optimizer.scope import build_scope
 import pandas as pd
 import logging
 import os
+from concurrent.futures import ProcessPoolExecutor
 
 logging.getLogger("sqlglot").setLevel(logging.ERROR)
 
@@ -25,36 +27,72 @@ def get_full_table_name(table_expr: Table) -> str:
     
     return '.'.join(parts)
 
-def get_source_tables(select_stmt):
-    """Get all source tables from a SELECT statement"""
+def get_scope_tables(scope):
+    """Map each source alias in a scope to its table name, or to the Scope of a derived table or CTE"""
     tables = {}
-    
-    # Process FROM clause
-    from_clause = select_stmt.find(sqlglot.expressions.From)
-    if from_clause:
-        for table in from_clause.find_all(Table):
-            full_name = get_full_table_name(table)
-            alias = table.args.get('alias')
-            if alias:
-                tables[alias.name] = full_name
-            else:
-                tables[full_name.split('.')[-1]] = full_name
+    # selected_sources follows FROM/JOIN order and leaves out CTEs the scope never reads
+    for name, (_, source) in scope.selected_sources.items():
+        if isinstance(source, Table):
+            tables[name] = get_full_table_name(source)
+        elif source.is_cte and is_enclosing_scope(source, scope):
+            # A recursive CTE reading itself keeps its name
+            tables[name] = name
+        elif source.is_udtf:
+            # LATERAL/UDTF and VALUES sources have no backing table; qualified
+            # columns keep the alias, unqualified ones are not attributed here
+            continue
+        else:
+            # Derived table or CTE: keep its scope so each column is resolved on its own
+            tables[name] = source
+    return tables
 
-    # Process JOIN clauses
-    for join in select_stmt.find_all(sqlglot.expressions.Join):
-        if isinstance(join.this, Table):
-            table = join.this
-            full_name = get_full_table_name(table)
-            alias = table.args.get('alias')
-            if alias:
-                tables[alias.name] = full_name
-            else:
-                tables[full_name.split('.')[-1]] = full_name
+def is_enclosing_scope(source, scope):
+    """Check whether a source scope is the given scope or one of its parents"""
+    while scope is not None:
+        if scope is source:
+            return True
+        scope = scope.parent
+    return False
 
-    return tables
+def get_branch_selects(scope):
+    """Get the SELECT scopes of a derived table or CTE, looking through every set-operation branch"""
+    branches = (getattr(scope, "set_operation_scopes", None)
+                or getattr(scope, "union_scopes", None))
+    if not branches:
+        return [scope] if isinstance(scope.expression, Select) else []
+    return [select for branch in branches for select in get_branch_selects(branch)]
+
+def resolve_source(source, column_name):
+    """Get the (source_column, source_table) pairs a column of a source is read from; empty when it cannot be resolved"""
+    if isinstance(source, str):
+        return [(column_name, source)]
+    
+    # Set-operation branches line up by position, not by name
+    names = source.expression.named_selects
+    if column_name not in names:
+        return []
+    position = names.index(column_name)
+    
+    resolved = []
+    for branch in get_branch_selects(source):
+        if position >= len(branch.expression.expressions):
+            continue
+        tables = get_scope_tables(branch)
+        default_source = next(iter(tables.values()), None)
+        for col in branch.expression.expressions[position].find_all(Column):
+            inner = tables.get(col.table) if col.table else default_source
+            if inner is not None:
+                resolved.extend(resolve_source(inner, col.name))
+    return list(dict.fromkeys(resolved))
 
-def process_select_expression(expr, tables, default_table):
-    """Process a single SELECT expression"""
+def get_source_tables(select_stmt):
+    """Get all source tables from a SELECT statement, keyed by alias"""
+    # Let sqlglot's scope analysis resolve FROM/JOIN aliases
+    scope = build_scope(select_stmt)
+    return get_scope_tables(scope) if scope else {}
+
+def process_select_expression(expr, tables, default_table, default_alias):
+    """Process a single SELECT expression into (view_column, source_column, source_table) tuples"""
     lineage = []
     
     # Get the view column name (target)
@@ -71,17 +109,16 @@ def process_select_expression(expr, tables, default_table):
     for col in expr_inner.find_all(Column):
         table_ref = col.table
         
-        # Determine the source table
+        # Determine the source table; a derived table may contribute several columns
         if table_ref:
-            source_table = tables.get(table_ref, table_ref)
+            source = tables.get(table_ref, table_ref)
         else:
-            source_table = default_table
-            
-        lineage.append({
-            "view_column": view_col,
-            "source_column": col.name,
-            "source_table": source_table
-        })
+            source = default_table
+            table_ref = default_alias
+        
+        # Keep the alias when a derived-table column cannot be traced
+        for source_column, source_table in resolve_source(source, col.name) or [(col.name, table_ref)]:
+            lineage.append((view_col, source_column, source_table))
     
     return lineage
 
@@ -96,61 +133,93 @@ def extract_column_lineage(sql_text: str) -> pd.DataFrame:
         if not create_stmt:
             return pd.DataFrame()
         
-        all_lineage = []
+        # Collect into a set so duplicates never reach the DataFrame
+        all_lineage = set()
         
-        # Handle UNION ALL case
-        union_stmt = create_stmt.find(Union)
-        if union_stmt:
-            for select in union_stmt.find_all(Select):
+        # The view body is the AS expression of CREATE; take it directly
+        # rather than searching the whole tree for a UNION or SELECT
+        query = create_stmt.expression
+        if isinstance(query, Subquery):
+            query = query.unnest()
+        
+        # Handle UNION ALL / INTERSECT / EXCEPT case: walk only the real branches,
+        # not SELECTs nested in derived tables or subqueries within them
+        if isinstance(query, SetOperation):
+            scope = build_scope(query)
+            for branch in (get_branch_selects(scope) if scope else []):
                 # Get source tables for this SELECT
-                tables = get_source_tables(select)
-                default_table = next(iter(tables.values())) if tables else "UNKNOWN"
+                tables = get_scope_tables(branch)
+                default_alias = next(iter(tables), "UNKNOWN")
+                default_table = tables.get(default_alias, default_alias)
                 
                 # Process each expression in the SELECT
-                for expr in select.expressions:
-                    lineage = process_select_expression(expr, tables, default_table)
-                    all_lineage.extend(lineage)
+                for expr in branch.expression.expressions:
+                    lineage = process_select_expression(expr, tables, default_table, default_alias)
+                    all_lineage.update(lineage)
         else:
             # Handle single SELECT case
-            select = create_stmt.find(Select)
+            select = query if isinstance(query, Select) else None
             if select:
                 tables = get_source_tables(select)
-                default_table = next(iter(tables.values())) if tables else "UNKNOWN"
+                default_alias = next(iter(tables), "UNKNOWN")
+                default_table = tables.get(default_alias, default_alias)
                 
                 for expr in select.expressions:
-                    lineage = process_select_expression(expr, tables, default_table)
-                    all_lineage.extend(lineage)
+                    lineage = process_select_expression(expr, tables, default_table, default_alias)
+                    all_lineage.update(lineage)
         
-        # Create DataFrame
-        df = pd.DataFrame(all_lineage)
-        if not df.empty:
-            # Clean up the results
-            df = df[df['source_column'].notna()]
-            df = df.drop_duplicates()
-            
-            # Handle cases where source_table is empty
-            df['source_table'] = df['source_table'].fillna(df['source_table'].mode()[0])
-            
-            # Sort the results
-            df = df.sort_values(['view_column', 'source_table', 'source_column'])
+        if not all_lineage:
+            return pd.DataFrame()
         
-        return df
+        # Sort by view_column, source_table, source_column and build the DataFrame once
+        rows = sorted(all_lineage, key=lambda r: (r[0], r[2], r[1]))
+        return pd.DataFrame(rows, columns=['view_column', 'source_column', 'source_table'])
     
     except Exception as e:
         print(f"Error processing SQL: {str(e)}")
         return pd.DataFrame()
 
+def extract_file_lineage(file_path: str) -> pd.DataFrame:
+    """Extract column lineage from a single SQL file"""
+    try:
+        with open(file_path, "r") as f:
+            sql = f.read()
+    except OSError as e:
+        print(f"Error reading file {file_path}: {str(e)}")
+        return pd.DataFrame()
+    
+    return extract_column_lineage(sql)
+
+def extract_lineage_from_files(file_paths, max_workers=None) -> pd.DataFrame:
+    """Extract column lineage from several SQL files in parallel processes"""
+    frames = []
+    workers = max_workers or os.cpu_count() or 1
+    
+    # Several chunks per worker, so short file lists still spread across processes
+    chunksize = max(1, len(file_paths) // (workers * 4))
+    
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(extract_file_lineage, file_paths, chunksize=chunksize)
+        for file_path, df in zip(file_paths, results):
+            if not df.empty:
+                df.insert(0, "source_file", file_path)
+                frames.append(df)
+    
+    # Concatenate once rather than per file
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
 def main():
     import argparse
     parser = argparse.ArgumentParser(description='Analyze SQL view definitions for column lineage')
-    parser.add_argument('file_path', help='Path to the SQL file containing view definition')
+    parser.add_argument('file_paths', nargs='+', help='Path(s) to SQL files containing view definitions')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes for multiple files (default: CPU count)')
     args = parser.parse_args()
     
     try:
-        with open(args.file_path, "r") as f:
-            sql = f.read()
-
-        df = extract_column_lineage(sql)
+        if len(args.file_paths) == 1:
+            df = extract_file_lineage(args.file_paths[0])
+        else:
+            df = extract_lineage_from_files(args.file_paths, args.workers)
 
         if df.empty:
             print("❌ No lineage found. Check if your SQL file has a valid SELECT block.")
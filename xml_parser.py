@@ -1,26 +1,48 @@
 #!/usr/bin/env python3
 # xml_to_mappings_all_sources.py
+import csv
+import mmap
 import re
 import sys
-import pandas as pd
-import xml.etree.ElementTree as ET
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from lxml import etree
 from pathlib import Path
 
+try:
+    import xlsxwriter
+except ImportError:  # optional; fall back to openpyxl
+    xlsxwriter = None
+
+COLUMNS = ("Target_Field", "Raw_ui_mapping_text", "All_Sources")
+
+# DIElements sent to a worker process at a time when running in parallel
+BATCH_SIZE = 1024
+
+# Workers re-parse serialized DIElements with the same settings as iter_dielements
+BLOB_PARSER = etree.XMLParser(huge_tree=True, remove_blank_text=True)
+
 # ---------- helpers ----------
 
-def strip_ns(elem):
-    """Remove XML namespaces in-place so tags are plain names."""
-    for e in elem.iter():
-        if isinstance(e.tag, str) and "}" in e.tag:
-            e.tag = e.tag.split("}", 1)[1]
+# Attribute element spellings used by different exports (any namespace)
+UI_ATTR_TAGS = ("{*}DIAttribute", "{*}DAttribute")
 
+# attribute names are few per export, so cache the lowercase/substring test
+@lru_cache(maxsize=256)
 def looks_like_ui_mapping(attr_name: str) -> bool:
     """Match ui_mapping_text with tolerance to spaces/case."""
-    return bool(attr_name) and "ui_mapping_text" in attr_name.lower()
+    # exact lowercase name first so the common case never allocates
+    return bool(attr_name) and (attr_name == "ui_mapping_text"
+                                or "ui_mapping_text" in attr_name.lower())
+
+STRING_LITERAL_RE = re.compile(r"'[^']*'")
 
 def remove_string_literals(expr: str) -> str:
     """Replace single-quoted strings with spaces to avoid false matches."""
-    return re.sub(r"'[^']*'", " ", expr or "")
+    if not expr or "'" not in expr:
+        return expr or ""
+    return STRING_LITERAL_RE.sub(" ", expr)
 
 # token: table.column  OR  schema.table.column (supports $, _ in names)
 SRC_TOKEN_RE = re.compile(
@@ -33,81 +55,180 @@ SRC_TOKEN_RE = re.compile(
 
 def extract_all_sources(expr: str):
     """Return a de-duplicated, order-preserved list of source tokens."""
-    if not expr:
+    # every token contains a dot, so dot-free expressions skip both regexes
+    if not expr or "." not in expr:
         return []
     s = remove_string_literals(expr)
-    matches = SRC_TOKEN_RE.findall(s)
-    seen = []
-    for m in matches:
-        if m not in seen:
-            seen.append(m)
-    return seen
+    return list(dict.fromkeys(SRC_TOKEN_RE.findall(s)))
+
+def extract_mapping(diel):
+    """Return (target, raw, all_sources) for a DIElement, or None if it has no usable value."""
+    target = (diel.get("name") or "").strip()
+    if not target:
+        return None
+
+    # Find the attribute carrying ui_mapping_text under this DIElement;
+    # lxml filters on the tag in C so only attribute elements reach Python
+    ui_attr = None
+    for da in diel.iter(*UI_ATTR_TAGS):
+        if looks_like_ui_mapping(da.get("name")):
+            ui_attr = da
+            break
+    if ui_attr is None:
+        return None
+
+    raw = (ui_attr.get("value") or "").strip()
+    # Only lowercase 4-character values rather than every expression
+    if not raw or (len(raw) == 4 and raw.lower() == "null"):
+        return None
+
+    sources = extract_all_sources(raw)
+    return target, raw, "; ".join(sources)  # keep sources as string for Excel
+
+def write_xlsx(rows, out_path: str, sheet_name: str = "Mappings") -> None:
+    """Stream rows in order with xlsxwriter in constant_memory mode."""
+    workbook = xlsxwriter.Workbook(out_path, {"constant_memory": True})
+    ws = workbook.add_worksheet(sheet_name)
+    ws.write_row(0, 0, COLUMNS)
+    for r, row in enumerate(rows, start=1):
+        ws.write_row(r, 0, row)
+    workbook.close()
+
+def write_xlsx_openpyxl(rows, out_path: str, sheet_name: str = "Mappings") -> None:
+    """Append rows to a write-only openpyxl workbook."""
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(sheet_name)
+    ws.append(COLUMNS)
+    for row in rows:
+        ws.append(row)
+    wb.save(out_path)
+
+def sorted_rows(columns):
+    """Yield rows ordered by Target_Field, sorting indices rather than row tuples."""
+    targets = columns[0]
+    for i in sorted(range(len(targets)), key=targets.__getitem__):
+        yield tuple(col[i] for col in columns)
+
+def write_csv(columns, csv_path: str) -> None:
+    """Write the mapping columns to CSV ordered by Target_Field."""
+    with open(csv_path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f, lineterminator="\n")
+        w.writerow(COLUMNS)
+        w.writerows(sorted_rows(columns))
 
 # ---------- main ----------
 
-def xml_to_tabular(xml_path: str, out_path: str = "ui_mappings.xlsx") -> None:
-    tree = ET.parse(xml_path)
-    root = tree.getroot()
-    strip_ns(root)
-
-    rows = []
+def iter_dielements(xml_path: str):
+    """Yield DIElements as they are parsed, freeing each once the caller moves on."""
+    # Feed the parser from a read-only memory map so pages come straight from the kernel
+    with open(xml_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        context = etree.iterparse(mm, events=("end",), tag="{*}DIElement",
+                                  huge_tree=True, remove_blank_text=True)
+        for _, diel in context:
+            yield diel
+            # A nested DIElement's siblings belong to the enclosing DIElement,
+            # which has not been processed yet; free only outermost subtrees
+            if next(diel.iterancestors("{*}DIElement"), None) is not None:
+                continue
+            diel.clear(keep_tail=True)
+            while diel.getprevious() is not None:
+                del diel.getparent()[0]
+
+def extract_mappings(diels):
+    """Return parallel (targets, raws, all_sources) lists for DIElements with a mapping."""
+    targets, raws, all_sources = [], [], []
+    for diel in diels:
+        row = extract_mapping(diel)
+        if row is not None:
+            target, raw, sources = row
+            # targets repeat heavily; interning shares one object per name
+            targets.append(sys.intern(target))
+            raws.append(raw)
+            all_sources.append(sources)
+    return targets, raws, all_sources
+
+def extract_mappings_batch(blobs):
+    """Worker entry point: re-parse serialized DIElements and extract their mappings."""
+    return extract_mappings(etree.fromstring(blob, BLOB_PARSER) for blob in blobs)
+
+def extract_mappings_parallel(diels, workers: int):
+    """Same as extract_mappings, with DIElements sharded across worker processes."""
+    targets, raws, all_sources = [], [], []
+    pending = deque()
+
+    def collect(future):
+        t, r, a = future.result()
+        targets.extend(map(sys.intern, t))  # re-intern after unpickling
+        raws.extend(r)
+        all_sources.extend(a)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        batch = []
+        for diel in diels:
+            batch.append(etree.tostring(diel, with_tail=False))
+            if len(batch) == BATCH_SIZE:
+                pending.append(pool.submit(extract_mappings_batch, batch))
+                batch = []
+                # Bound the serialized DIElements held in flight
+                if len(pending) > 2 * workers:
+                    collect(pending.popleft())
+        if batch:
+            pending.append(pool.submit(extract_mappings_batch, batch))
+        while pending:
+            collect(pending.popleft())
+
+    return targets, raws, all_sources
+
+def xml_to_tabular(xml_path: str, out_path: str = "ui_mappings.csv", workers: int = 1) -> None:
     diel_count = 0
-    hit_count = 0
-
-    # Iterate all DIElements
-    for diel in root.iter():
-        if not (isinstance(diel.tag, str) and diel.tag.endswith("DIElement")):
-            continue
-        diel_count += 1
-
-        target = (diel.get("name") or "").strip()
-        if not target:
-            continue
-
-        # Find the DIAttribute carrying ui_mapping_text under this DIElement
-        ui_attr = None
-        for da in diel.findall(".//DIAttribute"):
-            if looks_like_ui_mapping(da.get("name")):
-                ui_attr = da
-                break
-        if ui_attr is None:
-            continue
-
-        raw = (ui_attr.get("value") or "").strip()
-        if not raw or raw.lower() == "null":
-            continue
-
-        sources = extract_all_sources(raw)
-        hit_count += 1
-        rows.append({
-            "Target_Field": target,
-            "Raw_ui_mapping_text": raw,
-            "All_Sources": "; ".join(sources),  # keep as string for Excel
-        })
-
-    if not rows:
+
+    def counted(diels):
+        nonlocal diel_count
+        for diel in diels:
+            diel_count += 1
+            yield diel
+
+    # Stream the document and drop each DIElement subtree once processed
+    diels = counted(iter_dielements(xml_path))
+    if workers > 1:
+        targets, raws, all_sources = extract_mappings_parallel(diels, workers)
+    else:
+        targets, raws, all_sources = extract_mappings(diels)
+    hit_count = len(targets)
+
+    if not targets:
         print(f"Found {diel_count} DIElement tags, but no usable DIAttribute ui_mapping_text values.")
         return
 
-    df = pd.DataFrame(rows).sort_values("Target_Field").reset_index(drop=True)
+    columns = (targets, raws, all_sources)
+    stats = f"DIElements scanned={diel_count}, ui_mapping hits={hit_count}"
+
+    # CSV unless .xlsx is asked for explicitly
+    if Path(out_path).suffix.lower() != ".xlsx":
+        write_csv(columns, out_path)
+        print(f"Wrote {hit_count} mappings to {out_path} ({stats}).")
+        return
 
     # Write to Excel if possible; else CSV
     try:
-        with pd.ExcelWriter(out_path, engine="openpyxl") as xw:
-            df.to_excel(xw, index=False, sheet_name="Mappings")
-        print(f"Wrote {len(df)} mappings to {out_path} "
-              f"(DIElements scanned={diel_count}, ui_mapping hits={hit_count}).")
+        if xlsxwriter is not None:
+            write_xlsx(sorted_rows(columns), out_path)
+        else:
+            write_xlsx_openpyxl(sorted_rows(columns), out_path)
+        print(f"Wrote {hit_count} mappings to {out_path} ({stats}).")
     except ModuleNotFoundError:
         csv_path = str(Path(out_path).with_suffix(".csv"))
-        df.to_csv(csv_path, index=False)
-        print(f"'openpyxl' not installed; wrote CSV instead: {csv_path} "
-              f"(rows={len(df)}, DIElements={diel_count}, hits={hit_count}).")
+        write_csv(columns, csv_path)
+        print(f"No Excel writer installed; wrote CSV instead: {csv_path} "
+              f"(rows={hit_count}, DIElements={diel_count}, hits={hit_count}).")
 
 if __name__ == "__main__":
     if len(sys.argv) < 2:
         me = Path(sys.argv[0]).name
-        print(f"Usage: {me} <input.xml> [output.xlsx]")
+        print(f"Usage: {me} <input.xml> [output.csv|output.xlsx] [workers]")
         sys.exit(1)
     xml_in = sys.argv[1]
-    out_file = sys.argv[2] if len(sys.argv) > 2 else "ui_mappings.xlsx"
-    xml_to_tabular(xml_in, out_file)
+    out_file = sys.argv[2] if len(sys.argv) > 2 else "ui_mappings.csv"
+    n_workers = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+    xml_to_tabular(xml_in, out_file, n_workers)